@@ -1,8 +1,30 @@
 #!/usr/bin/env python3
-import re, argparse, yaml, pandas as pd
+import csv, functools, io, os, pickle, re, argparse, yaml
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import pdfplumber
 from docx import Document
+from openpyxl import Workbook
+
+try:
+    import ahocorasick
+except ImportError:        # optional accelerator; re fallback below
+    ahocorasick = None
+
+try:
+    import pypdfium2
+except ImportError:        # optional fast PDF backend; pdfplumber fallback
+    pypdfium2 = None
+
+try:
+    import re2
+except ImportError:        # optional DFA prefilter (google-re2)
+    re2 = None
+
+try:
+    import hyperscan
+except ImportError:        # optional SIMD header scanner
+    hyperscan = None
 
 LABELS = """
 last first dob cin asm_date a_present a_source a_mode caregiver_assist a_goc a_omcg a_cgcomm a_lvstatus a_lvarr a_ed a_sect_comments
@@ -40,23 +62,151 @@ sec_age sec_loc sec_120 sec_adl1 sec_adl2 sec_adl3 sf_120 sf_sched sf_alone
 """.split())
 
 def read_pdf(path: Path) -> str:
+    # Stream page text into a StringIO rather than list + join, which holds
+    # every page string alive twice for the duration of the join.
+    buf = io.StringIO()
     with pdfplumber.open(path) as pdf:
-        return "\n".join(page.extract_text() or "" for page in pdf.pages)
+        for i, page in enumerate(pdf.pages):
+            if i:
+                buf.write("\n")
+            buf.write(page.extract_text() or "")
+    return buf.getvalue()
+
+def read_pdf_fast(path: Path) -> str:
+    pdf = pypdfium2.PdfDocument(str(path))
+    try:
+        return "\n".join(page.get_textpage().get_text_bounded() for page in pdf)
+    finally:
+        pdf.close()
+
+_DOCX_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def iter_docx_paragraphs(path: Path):
+    # Read w:p/w:t straight off the lxml tree: one C-level findall/iter per
+    # paragraph instead of a python-docx Paragraph wrapper per .text access.
+    body = Document(path).element.body
+    for p in body.findall(f"{_DOCX_W}p"):
+        yield "".join(t.text or "" for t in p.iter(f"{_DOCX_W}t"))
 
 def read_docx(path: Path) -> str:
-    return "\n".join(p.text for p in Document(path).paragraphs)
+    return "\n".join(iter_docx_paragraphs(path))
 
 def load_text(path: Path) -> str:
-    return read_pdf(path) if path.suffix.lower() == ".pdf" else read_docx(path)
+    if path.suffix.lower() == ".pdf":
+        text = read_pdf_fast(path) if pypdfium2 is not None else ""
+        if not text.strip():
+            text = read_pdf(path)   # scanned PDFs / pypdfium2 not installed
+    else:
+        text = read_docx(path)
+    # normalize NBSP and PDFium's \r\n line endings once at ingestion so
+    # downstream patterns (notably the multiline $ in the header scan) never
+    # see them
+    return text.replace("\r\n", "\n").replace("\xa0", " ")
+
+def iter_lines(path: Path):
+    # Line-at-a-time variant of load_text for callers that only need
+    # sectionize(); peak memory stays O(page) instead of O(document).
+    if path.suffix.lower() == ".pdf":
+        if pypdfium2 is not None:
+            pdf = pypdfium2.PdfDocument(str(path))
+            try:
+                for page in pdf:
+                    yield from page.get_textpage().get_text_bounded().replace("\xa0", " ").splitlines()
+            finally:
+                pdf.close()
+        else:
+            with pdfplumber.open(path) as pdf:
+                for page in pdf.pages:
+                    yield from (page.extract_text() or "").replace("\xa0", " ").splitlines()
+    else:
+        for para in iter_docx_paragraphs(path):
+            yield para.replace("\xa0", " ")
+
+def _next_sentence_punct(text: str, i: int) -> int:
+    best = -1
+    for c in ".!?":
+        j = text.find(c, i)
+        if j != -1 and (best == -1 or j < best):
+            best = j
+    return best
 
 def first_n_sentences(text: str, n=2) -> str:
-    parts = re.split(r'(?<=[.!?])\s+(?=[A-Z])', text.strip())
-    return " ".join(parts[:n])
+    # Manual scan for [.!?] + whitespace + uppercase; the old
+    # lookbehind/lookahead re.split is among the slowest re constructs and
+    # str.find runs in C.
+    text = text.strip()
+    out, start, i, length = [], 0, 0, len(text)
+    while len(out) < n:
+        j = _next_sentence_punct(text, i)
+        if j == -1:
+            out.append(text[start:])
+            break
+        k = j + 1
+        while k < length and text[k].isspace():
+            k += 1
+        if k > j + 1 and k < length and "A" <= text[k] <= "Z":
+            out.append(text[start:j + 1])
+            start = i = k
+        else:
+            i = j + 1
+    return " ".join(out)
+
+_HEADER_RE = re.compile(r"^([\w ,/()]+):\s*$")
+
+_HS_DB = None
+
+def _header_db():
+    global _HS_DB
+    if _HS_DB is None:
+        _HS_DB = hyperscan.Database()
+        # same char class as _HEADER_RE (leading spaces included); UTF8|UCP
+        # so \w covers non-ASCII word chars like Python's re does
+        _HS_DB.compile(
+            expressions=[rb"^[\w ,/()]+:[ \t]*$"],
+            flags=[
+                hyperscan.HS_FLAG_MULTILINE | hyperscan.HS_FLAG_SOM_LEFTMOST
+                | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP
+            ],
+        )
+    return _HS_DB
+
+def _sectionize_hs(text: str) -> dict:
+    # Find every candidate header offset in one SIMD scan, then build the
+    # sections by slicing between accepted headers. Offsets are byte-based,
+    # so all slicing happens on the encoded text.
+    data = text.encode("utf-8")
+    spans = []
+    _header_db().scan(data, match_event_handler=lambda pid, start, end, flags, ctx: spans.append((start, end)))
+    spans.sort()
+    sections, cur, pos = {}, "_preamble", 0
+    for start, end in spans:
+        header = data[start:end].decode("utf-8")
+        m = _HEADER_RE.match(header)
+        if not (m and (header.isupper() or header.istitle())):
+            continue        # body line that happens to end with a colon
+        # a later duplicate header overwrites, like the list reset below
+        chunk = data[pos:start].decode("utf-8").strip()
+        # the fallback keeps _preamble whenever any line precedes the first
+        # header, even a blank one (start > 0), so mirror that here
+        if cur != "_preamble" or chunk or start:
+            sections[cur] = chunk
+        cur, pos = m.group(1).lower(), end + 1
+    chunk = data[pos:].decode("utf-8").strip()
+    if cur != "_preamble" or chunk or data:
+        sections[cur] = chunk
+    return sections
 
-def sectionize(text: str) -> dict:
+def sectionize(text) -> dict:
+    # Accepts the full document string or any iterable of lines (iter_lines).
+    if hyperscan is not None and isinstance(text, str):
+        return _sectionize_hs(text)
     sections, cur = {}, "_preamble"
-    for line in text.splitlines():
-        m = re.match(r"^([\w ,/()]+):\s*$", line)
+    for line in (text.splitlines() if isinstance(text, str) else text):
+        # cheap C-level prefilter: no colon means no header, skip the regex
+        if ":" not in line:
+            sections.setdefault(cur, []).append(line)
+            continue
+        m = _HEADER_RE.match(line)
         if m and (line.isupper() or line.istitle()):
             cur = m.group(1).lower()
             sections[cur] = []
@@ -64,38 +214,206 @@ def sectionize(text: str) -> dict:
             sections.setdefault(cur, []).append(line)
     return {k: "\n".join(v).strip() for k, v in sections.items()}
 
-def load_yaml() -> dict:
+@functools.lru_cache(maxsize=1)
+def load_rules() -> dict:
     yml = Path("label_map.yml")
     return yaml.safe_load(yml.read_text()) if yml.exists() else {}
 
+# bump whenever the expanded-rules shape changes, so stale pickles rebuild
+_RULES_CACHE_VERSION = 3
+
+def load_expanded_rules() -> dict:
+    # Expanding + compiling the rules is pure startup overhead, so stash the
+    # finished object in a pickle next to the YAML, keyed by its mtime.
+    yml, pkl = Path("label_map.yml"), Path("label_map.pkl")
+    if pkl.exists() and (not yml.exists() or pkl.stat().st_mtime >= yml.stat().st_mtime):
+        try:
+            version, rules = pickle.loads(pkl.read_bytes())
+            if version == _RULES_CACHE_VERSION:
+                return rules
+        except Exception:
+            pass        # stale/corrupt cache; rebuild below
+    rules = expand_wildcards(load_rules())
+    try:
+        pkl.write_bytes(pickle.dumps((_RULES_CACHE_VERSION, rules)))
+    except OSError:
+        pass            # read-only dir; caching is best-effort
+    return rules
+
+def compile_rule(rule: dict) -> dict:
+    # Pre-compile every pattern a rule can need so extract() never builds
+    # regexes inside its per-label loop.
+    variants = rule.get("search", []) if rule.get("type") != "regex" else []
+    rule["_search_lc"] = [v.lower() for v in variants]
+    rule["_name"] = [re.compile(v, re.I) for v in variants]
+    rule["_single"] = [
+        re.compile(rf"{re.escape(v)}[\s:]*(.+?)(?=\s{{2,}}|\n|$)", re.I)
+        for v in variants
+    ]
+    rule["_multi"] = [
+        re.compile(rf"{re.escape(v)}[\s:]*(.+?)(?=\n[A-Z0-9 ,/()]+:\s|\n\s*\n|$)", re.I | re.S)
+        for v in variants
+    ]
+    if rule.get("type") == "regex":
+        rule["_pattern"] = re.compile(rule["pattern"], re.I | re.S | re.M)
+    return rule
+
+@functools.lru_cache(maxsize=None)
+def _default_rule(label: str) -> dict:
+    # single_line fallback for labels the YAML does not cover; memoized so the
+    # ~1,270 default patterns compile once per process, never per extract()
+    return compile_rule({"search": [label.replace("_", " ")], "type": "single_line"})
+
 def expand_wildcards(rules: dict, max_n=30) -> dict:
+    # Values are (rule, row) pairs; wildcard rows all share one rule object
+    # (and its compiled patterns) instead of 30 dict copies per rule.
     out = {}
     for lab, rule in rules.items():
+        compile_rule(rule)
         if "*" in lab:
             for i in range(1, max_n + 1):
-                out[lab.replace("*", str(i))] = {**rule, "row": i-1}
+                out[lab.replace("*", str(i))] = (rule, i - 1)
         else:
-            out[lab] = rule
+            out[lab] = (rule, None)
+    # materialize the defaults too, so they ride the pickle cache
+    for lab in LABELS:
+        out.setdefault(lab, (_default_rule(lab), None))
     return out
 
-def extract(path: Path) -> dict:
+# Everything a single_line anchor needs after the literal: optional colon/space
+# run, then the value up to a double space or end of line. The value must open
+# with a non-space/colon char so a bare "Label:" line yields no value.
+_TAIL_RE = re.compile(r"[\s:]*([^\s:].*?)(?=\s{2,}|$)")
+
+def build_automaton(rules: dict):
+    # One Aho-Corasick automaton over every single_line anchor (explicit rules
+    # plus the label-name defaults) so extract() can find all of them in a
+    # single pass over the text instead of one re.search per label x variant.
+    if ahocorasick is None:
+        return None
+    words = {}
+    for label in LABELS:
+        rule, _ = rules.get(label, (None, None))
+        if rule is not None and rule["type"] != "single_line":
+            continue
+        variants = rule["search"] if rule else [label.replace("_", " ")]
+        for v in variants:
+            words.setdefault(v.lower(), []).append(label)
+    automaton = ahocorasick.Automaton()
+    for word, labels in words.items():
+        automaton.add_word(word, labels)
+    automaton.make_automaton()
+    return automaton
+
+def build_re2_set(rules: dict):
+    # RE2 compiles all anchors into one DFA and reports which ones occur in a
+    # single linear scan. RE2 has no lookahead, so the set only answers "which
+    # labels have an anchor in this text"; extraction still runs the matched
+    # labels' compiled re patterns.
+    if re2 is None:
+        return None
+    rset, entries = re2.Set.SearchSet(), []
+    for label in LABELS:
+        rule, _ = rules.get(label, (None, None))
+        if rule is not None and rule["type"] != "single_line":
+            continue
+        variants = rule["search"] if rule else [label.replace("_", " ")]
+        for v in variants:
+            rset.Add("(?i)" + re.escape(v))
+            entries.append(label)
+    rset.Compile()
+    return rset, entries
+
+# (rules, automaton, re2_set) — the scanners depend only on the rules object,
+# which is one pickle-backed dict per process, so rebuild only when it changes
+_SCANNERS = (None, None, None)
+
+def get_scanners(rules: dict):
+    global _SCANNERS
+    if _SCANNERS[0] is not rules:
+        automaton = build_automaton(rules)
+        re2_set = build_re2_set(rules) if automaton is None else None
+        _SCANNERS = (rules, automaton, re2_set)
+    return _SCANNERS[1], _SCANNERS[2]
+
+def scan_anchors(text: str, automaton) -> dict:
+    hits = {}
+    lower = text.lower()
+    for end, labels in automaton.iter(lower):
+        if all(lab in hits for lab in labels):
+            continue
+        nl = text.find("\n", end + 1)
+        line = text[end + 1 : len(text) if nl == -1 else nl]
+        m = _TAIL_RE.match(line)
+        val = m.group(1).strip() if m else ""
+        # record "" too: it marks the anchor as present so extract() can fall
+        # back to the compiled pattern, whose [\s:]* spans the newline
+        for lab in labels:
+            hits.setdefault(lab, val)
+    return hits
+
+def iter_candidate_secs(sections: dict, rule: dict, text: str):
+    # Lazy: section bodies are yielded as they match, so extract() stops
+    # scanning as soon as a variant produces a value.
+    found = False
+    if rule.get("name_is_regex"):
+        for n, s in sections.items():
+            if any(p.search(n) for p in rule["_name"]):
+                found = True
+                yield s
+    else:
+        for n, s in sections.items():
+            if any(v in n for v in rule["_search_lc"]):
+                found = True
+                yield s
+    if not found:
+        yield text
+
+def extract(path: Path, rules: dict = None) -> dict:
     text = load_text(path)
     sections = sectionize(text)
-    rules = expand_wildcards(load_yaml())
+    if rules is None:
+        rules = load_expanded_rules()
+    automaton, re2_set = get_scanners(rules)
+    anchor_hits = scan_anchors(text, automaton) if automaton is not None else None
+    anchored = None
+    if anchor_hits is None and re2_set is not None:
+        rset, entries = re2_set
+        anchored = {entries[i] for i in rset.Match(text) or []}
+    text_lower = text.lower()
     row = {lab: "" for lab in LABELS}
     for label in LABELS:
         if row[label]:
             continue
-        rule = rules.get(label) or {"search": [label.replace('_', ' ')], "type": "single_line"}
+        rule, row_idx = rules.get(label) or (_default_rule(label), None)
         rule_type = rule["type"]
-        variants = rule.get("search", []) if rule_type != "regex" else []
-        cand_secs = [s for n, s in sections.items() if any(re.search(v, n, re.I) for v in variants)] or [text]
+        # Wildcard-expanded rows (ma_drug1..30, notes1..30, ...) are mostly
+        # absent; one substring test per variant skips all their regex work.
+        if row_idx is not None and rule["_search_lc"] and not any(v in text_lower for v in rule["_search_lc"]):
+            continue
+        if rule_type == "single_line":
+            if anchor_hits is not None:
+                val = anchor_hits.get(label)
+                if val:
+                    row[label] = val
+                    continue
+                if val is None:
+                    continue    # anchor literal absent, the regex cannot match
+                # anchor present but no same-line value: fall through, the
+                # compiled pattern's [\s:]* spans the newline to the next line
+            if anchored is not None and label not in anchored:
+                continue        # anchor literal absent, the regex cannot match
+        cand_secs = iter_candidate_secs(sections, rule, text)
         val = ""
         if rule_type == "single_line":
             for sec in cand_secs:
-                for v in variants:
-                    pat = rf"{re.escape(v)}[\s:]*(.+?)(?=\s{{2,}}|\n|$)"
-                    m = re.search(pat, sec, flags=re.I)
+                # each pattern starts with its escaped variant, so a SIMD
+                # str-find miss on the literal rules the regex out
+                sec_lc = text_lower if sec is text else sec.lower()
+                for v_lc, pat in zip(rule["_search_lc"], rule["_single"]):
+                    if v_lc not in sec_lc:
+                        continue
+                    m = pat.search(sec)
                     if m:
                         val = m.group(1).strip()
                         break
@@ -103,36 +421,71 @@ def extract(path: Path) -> dict:
                     break
         elif rule_type == "multi_line":
             for sec in cand_secs:
-                for v in variants:
-                    pat = rf"{re.escape(v)}[\s:]*(.+?)(?=\n[A-Z0-9 ,/()]+:\s|\n\s*\n|$)"
-                    m = re.search(pat, sec, flags=re.I | re.S)
+                sec_lc = text_lower if sec is text else sec.lower()
+                for v_lc, pat in zip(rule["_search_lc"], rule["_multi"]):
+                    if v_lc not in sec_lc:
+                        continue
+                    m = pat.search(sec)
                     if m:
                         val = " ".join(m.group(1).splitlines()).strip()
                         break
                 if val:
                     break
         elif rule_type == "paragraph":
-            val = first_n_sentences(cand_secs[0], rule.get("keep_n_sentences", 2))
+            val = first_n_sentences(next(cand_secs), rule.get("keep_n_sentences", 2))
         elif rule_type == "regex":
-            pat = rule["pattern"]
-            m = re.search(pat, text, flags=re.I | re.S | re.M)
+            pat = rule["_pattern"]
+            m = pat.search(text)
             if not m:
                 for sec in cand_secs:
-                    m = re.search(pat, sec, flags=re.I | re.S | re.M)
+                    m = pat.search(sec)
                     if m:
                         break
             val = m.group(1).strip() if m else ""
         row[label] = val
     return row
 
+def write_rows(rows, headers, out_path):
+    if out_path.endswith(".xlsx"):
+        # write-only mode streams rows without per-cell Cell objects
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(headers)
+        for row in rows:
+            ws.append([row.get(h, "") for h in headers])
+        wb.save(out_path)
+    else:
+        with open(out_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            for row in rows:
+                writer.writerow([row.get(h, "") for h in headers])
+
 def write_row(row, headers, out_path):
-    df = pd.DataFrame([[row.get(h, "") for h in headers]], columns=headers)
-    (df.to_excel if out_path.endswith(".xlsx") else df.to_csv)(out_path, index=False)
+    write_rows([row], headers, out_path)
+
+_WORKER_RULES = None
+
+def _init_worker():
+    global _WORKER_RULES
+    _WORKER_RULES = load_expanded_rules()
+
+def _extract_one(path):
+    return extract(path, _WORKER_RULES)
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
-    ap.add_argument("file")
+    ap.add_argument("file", help="a document, or a directory to batch-process")
     ap.add_argument("-o", "--out", default="output.xlsx")
     args = ap.parse_args()
-    write_row(extract(Path(args.file)), LABELS, args.out)
-    print(f"Saved {args.out}")
+    target = Path(args.file)
+    if target.is_dir():
+        paths = sorted(p for p in target.iterdir() if p.suffix.lower() in (".pdf", ".docx"))
+        load_expanded_rules()   # warm the pickle cache once before forking
+        with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker) as ex:
+            rows = list(ex.map(_extract_one, paths))
+        write_rows(rows, LABELS, args.out)
+        print(f"Saved {len(rows)} rows to {args.out}")
+    else:
+        write_row(extract(target), LABELS, args.out)
+        print(f"Saved {args.out}")
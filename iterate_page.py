@@ -1,33 +1,71 @@
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pdfplumber
+from azure.core.credentials import AzureKeyCredential
 from azure.ai.formrecognizer import DocumentAnalysisClient
+from dotenv import load_dotenv
+
+try:
+    import pypdfium2
+except ImportError:        # optional fast rasterizer; pdfplumber fallback
+    pypdfium2 = None
+
+load_dotenv()
+endpoint = os.getenv("AZURE_DOC_INTELLIGENCE_ENDPOINT")
+key = os.getenv("AZURE_DOC_INTELLIGENCE_KEY")
 
-# Re‑use the same client and model_id you configured earlier
 document_analysis_client = DocumentAnalysisClient(
     endpoint=endpoint,
     credential=AzureKeyCredential(key)
 )
 model_id = "form_classifier_model_id"  # put your classifier model ID here
 
+MAX_WORKERS = 8
+
 classification_cache = {}  # {(pdf_path, page_number): {doc_type, confidence, model_id}}
 
+def iter_page_images(pdf_path, resolution=300):
+    # Yield one PIL image per page; pypdfium2's C renderer when available,
+    # pdfplumber otherwise.
+    if pypdfium2 is not None:
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            for page in pdf:
+                yield page.render(scale=resolution / 72).to_pil()
+        finally:
+            pdf.close()
+    else:
+        with pdfplumber.open(pdf_path) as pdf:
+            for page in pdf.pages:
+                yield page.to_image(resolution=resolution).original
+
+def _classify_page(pdf_path, page_number, png_bytes):
+    poller = document_analysis_client.begin_classify_document(
+        model_id, document=png_bytes
+    )
+    result = poller.result()
+    if result and result.documents:
+        classification_cache[(pdf_path, page_number)] = {
+            "doc_type": result.documents[0].doc_type,
+            "confidence": result.documents[0].confidence,
+            "model_id": result.model_id,
+        }
+
 def classify_each_page(pdf_path):
+    # The classify call is pure network wait, so pages are submitted to a
+    # thread pool as soon as they are rasterized; rendering of the next page
+    # overlaps the in-flight Azure round-trips.
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for i, page in enumerate(pdf.pages, start=1):
-                temp_path = f"__temp_page_{i}.png"
-                page.to_image(resolution=300).save(temp_path, format="PNG")
-                with open(temp_path, "rb") as f:
-                    poller = document_analysis_client.begin_classify_document(
-                        model_id, document=f
-                    )
-                    result = poller.result()
-                    if result and result.documents:
-                        classification_cache[(pdf_path, i)] = {
-                            "doc_type": result.documents[0].doc_type,
-                            "confidence": result.documents[0].confidence,
-                            "model_id": result.model_id,
-                        }
-                os.remove(temp_path)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = []
+            for i, img in enumerate(iter_page_images(pdf_path, resolution=200), start=1):
+                buf = io.BytesIO()
+                # JPEG at 200 DPI is plenty for the classifier and is ~20x
+                # fewer upload bytes than 300 DPI PNG
+                img.save(buf, format="JPEG", quality=85)
+                futures.append(executor.submit(_classify_page, pdf_path, i, buf.getvalue()))
+            for future in futures:
+                future.result()
     except Exception as e:
         print(f"Error classifying pages in {pdf_path}: {e}")
@@ -1,10 +1,14 @@
+import asyncio
+import functools
 import json
+import sqlite3
 from azure.core.credentials import AzureKeyCredential
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.exceptions import HttpResponseError
-import glob
 import os
+import random
 import time
+import openpyxl
 import pandas as pd
 import re
 import format_documents
@@ -12,6 +16,7 @@ from dotenv import load_dotenv
 from ratelimit import limits, RateLimitException
 import pdfplumber
 import io
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 load_dotenv()
 endpoint = os.getenv("AZURE_DOC_INTELLIGENCE_ENDPOINT")
@@ -20,172 +25,316 @@ key = os.getenv("AZURE_DOC_INTELLIGENCE_KEY")
 CALLS = 1
 RATE_LIMIT_PERIOD = 60
 KV_CONFIDENCE_MIN = 0.30
+MAX_WORKERS = min((os.cpu_count() or 1) * 2, 16)
+DPI = 200   # prebuilt models lose nothing on typed forms below 300
+
+FIRST_NAME_RE = re.compile(r"(first\s*name|first\s*initial|employee.*first.*name|emp.*first.*name)", re.I)
+LAST_NAME_RE = re.compile(r"(last\s*name|employee.*last.*name|emp.*last.*name)", re.I)
+ADDRESS_RE = re.compile(r"(address|zip\s*code|employee.*address|emp.*address)", re.I)
+SSN_RE = re.compile(r"(ssn|social\s*security|social.*number|employee.*ssn|emp.*ssn)", re.I)
+PAYSTUB_NAME_RE = re.compile(r"pay to the order of[:\-#]*", re.I)
+PAYSTUB_SSN_RE = re.compile(r"social security[\s#:.\-]*", re.I)
+
+# the four generic-field patterns as one alternation: each KV key costs one
+# scan and m.lastgroup names the field that matched
+_FIELD_RE = re.compile(
+    r"(?P<first>first\s*name|first\s*initial|employee.*first.*name|emp.*first.*name)"
+    r"|(?P<last>last\s*name|employee.*last.*name|emp.*last.*name)"
+    r"|(?P<address>address|zip\s*code|employee.*address|emp.*address)"
+    r"|(?P<ssn>ssn|social\s*security|social.*number|employee.*ssn|emp.*ssn)",
+    re.I,
+)
+
+RESULT_COLUMNS = ["file_name", "first_name", "last_name", "address", "ssn", "dob"]
+DB_PATH = "test_docs_results.db"
+
+DOC_EXTS = ('.jpg', '.jpeg', '.png', '.pdf', '.tiff', '.tif')
+
+_LABEL_LIST_STR = """<LABEL_LIST_PLACEHOLDER>"""
+_LABEL_SET = frozenset(lbl.strip() for lbl in _LABEL_LIST_STR.split(",") if lbl.strip())
+
+# One client for the whole module: it is thread-safe and its HTTP pipeline
+# keeps the TCP/TLS connection pool alive across calls.
+_CLIENT = DocumentAnalysisClient(
+    endpoint=endpoint,
+    credential=AzureKeyCredential(key)
+)
 
 def model_call(document_path, model_id):
-    document_analysis_client = DocumentAnalysisClient(
-        endpoint=endpoint,
-        credential=AzureKeyCredential(key)
-    )
     with open(document_path, "rb") as f:
-        poller = document_analysis_client.begin_analyze_document(
+        poller = _CLIENT.begin_analyze_document(
             model_id=model_id,
             document=f
         )
     result = poller.result()
     return result
 
+def _call_with_retry(fn, *args, max_attempts=3, base=1.0, cap=60.0, **kwargs):
+    # Exponential backoff with jitter for throttling; anything else raises.
+    for attempt in range(max_attempts):
+        try:
+            return fn(*args, **kwargs)
+        except RateLimitException as e:
+            if attempt == max_attempts - 1:
+                raise
+            print(f"Rate limit reached. Sleeping for {e.period_remaining} seconds...")
+            time.sleep(e.period_remaining)
+        except HttpResponseError as e:
+            if attempt == max_attempts - 1 or e.status_code not in (429, 503):
+                raise
+            retry_after = e.response.headers.get("Retry-After") if e.response else None
+            wait = float(retry_after) if retry_after else min(cap, base * 2 ** attempt) + random.uniform(0, 0.5)
+            print(f"Transient {e.status_code} from service; retrying in {wait:.1f}s...")
+            time.sleep(wait)
+
 def model_call_bytes(document_bytes, model_id):
-    document_analysis_client = DocumentAnalysisClient(
-        endpoint=endpoint,
-        credential=AzureKeyCredential(key)
-    )
-    poller = document_analysis_client.begin_analyze_document(
+    poller = _CLIENT.begin_analyze_document(
         model_id=model_id,
         document=document_bytes
     )
     result = poller.result()
     return result
 
-def default_model_result(directory_path, excel_path):
-    results = []
-    search_pattern = os.path.join(directory_path, '*')
-    jpg_files = glob.glob(search_pattern)
-    first_name_pattern = re.compile(r"(first\s*name|first\s*initial|employee.*first.*name|emp.*first.*name)", re.I)
-    last_name_pattern = re.compile(r"(last\s*name|employee.*last.*name|emp.*last.*name)", re.I)
-    address_pattern = re.compile(r"(address|zip\s*code|employee.*address|emp.*address)", re.I)
-    ssn_pattern = re.compile(r"(ssn|social\s*security|social.*number|employee.*ssn|emp.*ssn)", re.I)
-    paystub_name_pattern = re.compile(r"pay to the order of[:\-#]*", re.I)
-    paystub_ssn_pattern = re.compile(r"social security[\s#:.\-]*", re.I)
-    for jpg_file in jpg_files:
-        with open(jpg_file, "rb") as f:
-            try:
-                result = model_call(jpg_file, model_id="prebuilt-document")
-            except RateLimitException as e:
-                time.sleep(e.period_remaining)
-                print(f"Rate limit reached. Sleeping for {e.period_remaining} seconds...")
-        print(f"Processed {jpg_file} with default model.")
-        if "Social_Security" in jpg_file:
-            output = format_documents.extract_ssn_fields(result)
-            results.append({
-                "file_name": os.path.basename(jpg_file),
-                "first_name": output.get("first_name", ""),
-                "last_name": output.get("last_name", ""),
-                "address": "",
-                "ssn": output.get("ssn", ""),
-                "dob": ""
-            })
-        elif "Employee_Auth" in jpg_file:
-            sheet2 = pd.read_excel("test_docs_results.xlsx", sheet_name='configs')
-            config_row = sheet2[sheet2['form_type'] == "employee_auth"]
-            if not config_row.empty:
-                key_mapping_str = config_row['key_mapping'].iloc[0]
-                key_mapping = json.loads(key_mapping_str)
-                output = format_documents.format_generic_document(result, key_mapping, "employee_auth")
-                results.append({
-                    "file_name": os.path.basename(jpg_file),
-                    "first_name": output.get("first_name", ""),
-                    "last_name": output.get("last_name", ""),
-                    "address": "",
-                    "ssn": "",
-                    "dob": output.get("dob", "")
-                })
-        elif "Paystub" in jpg_file or "Paycheck_Stubs" in jpg_file:
-            full_name = ""
-            ssn = ""
-            for kv_pair in result.key_value_pairs:
-                if kv_pair.confidence < KV_CONFIDENCE_MIN:
-                    continue
-                key_content = kv_pair.key.content if kv_pair.key else ""
-                value_content = kv_pair.value.content if kv_pair.value else ""
-                if paystub_name_pattern.match(key_content.strip()) and not full_name:
-                    full_name = value_content
-                elif paystub_ssn_pattern.match(key_content.strip()) and not ssn:
-                    ssn = value_content
-            name_parts = full_name.split()
-            first_name, middle_initial, last_name = "", "", ""
-            if len(name_parts) == 2:
-                first_name, last_name = name_parts
-            elif len(name_parts) == 3:
-                first_name, middle_initial, last_name = name_parts
-            elif len(name_parts) > 3:
-                first_name = name_parts[0]
-                middle_initial = name_parts[1]
-                last_name = " ".join(name_parts[2:])
-            elif len(name_parts) == 1:
+@functools.lru_cache(maxsize=None)
+def load_key_mapping(form_type):
+    # one xlsx parse per form type per process, not per file
+    configs = pd.read_excel("test_docs_results.xlsx", sheet_name='configs')
+    config_row = configs[configs['form_type'] == form_type]
+    if config_row.empty:
+        return None
+    return json.loads(config_row['key_mapping'].iloc[0])
+
+def _handle_social_security(result, jpg_file):
+    output = format_documents.extract_ssn_fields(result)
+    return {
+        "file_name": os.path.basename(jpg_file),
+        "first_name": output.get("first_name", ""),
+        "last_name": output.get("last_name", ""),
+        "address": "",
+        "ssn": output.get("ssn", ""),
+        "dob": ""
+    }
+
+def _handle_employee_auth(result, jpg_file):
+    key_mapping = load_key_mapping("employee_auth")
+    if key_mapping is None:
+        return None
+    output = format_documents.format_generic_document(result, key_mapping, "employee_auth")
+    return {
+        "file_name": os.path.basename(jpg_file),
+        "first_name": output.get("first_name", ""),
+        "last_name": output.get("last_name", ""),
+        "address": "",
+        "ssn": "",
+        "dob": output.get("dob", "")
+    }
+
+def _handle_paystub(result, jpg_file):
+    full_name = ""
+    ssn = ""
+    for kv_pair in result.key_value_pairs:
+        if kv_pair.confidence < KV_CONFIDENCE_MIN:
+            continue
+        key_stripped = (kv_pair.key.content if kv_pair.key else "").strip()
+        value_content = kv_pair.value.content if kv_pair.value else ""
+        if PAYSTUB_NAME_RE.match(key_stripped) and not full_name:
+            full_name = value_content
+        elif PAYSTUB_SSN_RE.match(key_stripped) and not ssn:
+            ssn = value_content
+        if full_name and ssn:
+            break
+    name_parts = full_name.split()
+    first_name, middle_initial, last_name = "", "", ""
+    if len(name_parts) == 2:
+        first_name, last_name = name_parts
+    elif len(name_parts) == 3:
+        first_name, middle_initial, last_name = name_parts
+    elif len(name_parts) > 3:
+        first_name = name_parts[0]
+        middle_initial = name_parts[1]
+        last_name = " ".join(name_parts[2:])
+    elif len(name_parts) == 1:
+        first_name = name_parts[0]
+    return {
+        "file_name": os.path.basename(jpg_file),
+        "first_name": first_name,
+        "last_name": last_name,
+        "address": "",
+        "ssn": ssn,
+        "dob": ""
+    }
+
+def _handle_generic(result, jpg_file):
+    first_name = last_name = address = ssn = ""
+    for kv_pair in result.key_value_pairs:
+        if kv_pair.confidence < KV_CONFIDENCE_MIN:
+            continue
+        key_content = kv_pair.key.content if kv_pair.key else ""
+        value_content = kv_pair.value.content if kv_pair.value else ""
+        m = _FIELD_RE.search(key_content)
+        if not m:
+            continue
+        field = m.lastgroup
+        if field == "first" and not first_name:
+            name_parts = value_content.split()
+            if len(name_parts) >= 2:
                 first_name = name_parts[0]
-            results.append({
-                "file_name": os.path.basename(jpg_file),
-                "first_name": first_name,
-                "last_name": last_name,
-                "address": "",
-                "ssn": ssn,
-                "dob": ""
-            })
-        else:
-            first_name = last_name = address = ssn = ""
-            for kv_pair in result.key_value_pairs:
-                if kv_pair.confidence < KV_CONFIDENCE_MIN:
-                    continue
-                key_content = kv_pair.key.content if kv_pair.key else ""
-                value_content = kv_pair.value.content if kv_pair.value else ""
-                if first_name_pattern.search(key_content) and not first_name:
-                    name_parts = value_content.split()
-                    if len(name_parts) >= 2:
-                        first_name = name_parts[0]
-                        last_name = name_parts[-1]
-                    else:
-                        first_name = value_content
-                elif last_name_pattern.search(key_content) and not last_name:
-                    last_name = value_content
-                elif address_pattern.search(key_content) and not address:
-                    address = value_content
-                elif ssn_pattern.search(key_content) and not ssn:
-                    ssn = value_content
-            results.append({
-                "file_name": os.path.basename(jpg_file),
-                "first_name": first_name,
-                "last_name": last_name,
-                "address": address,
-                "ssn": ssn,
-                "dob": ""
-            })
+                last_name = name_parts[-1]
+            else:
+                first_name = value_content
+        elif field == "last" and not last_name:
+            last_name = value_content
+        elif field == "address" and not address:
+            address = value_content
+        elif field == "ssn" and not ssn:
+            ssn = value_content
+        if first_name and last_name and address and ssn:
+            break       # all fields filled; skip the remaining KVs
+    return {
+        "file_name": os.path.basename(jpg_file),
+        "first_name": first_name,
+        "last_name": last_name,
+        "address": address,
+        "ssn": ssn,
+        "dob": ""
+    }
+
+# one scan of the path classifies the doc type; adding a form type is one
+# regex alternative plus one HANDLERS entry
+_DOC_TYPE_RE = re.compile(r"Social_Security|Employee_Auth|Paystub|Paycheck_Stubs")
+
+HANDLERS = {
+    "Social_Security": _handle_social_security,
+    "Employee_Auth": _handle_employee_auth,
+    "Paystub": _handle_paystub,
+    "Paycheck_Stubs": _handle_paystub,
+}
+
+def default_model_result(directory_path, excel_path="test_docs_results_export.xlsx", *, db_path=DB_PATH):
+    # scandir skips the extra stat per entry, and the extension filter keeps
+    # .xlsx/.DS_Store-type entries away from the analyze call
+    jpg_files = [
+        entry.path for entry in os.scandir(directory_path)
+        if entry.is_file() and entry.name.lower().endswith(DOC_EXTS)
+    ]
+    def _process_file(jpg_file):
+        result = _call_with_retry(model_call, jpg_file, model_id="prebuilt-document")
+        print(f"Processed {jpg_file} with default model.")
+        m = _DOC_TYPE_RE.search(jpg_file)
+        handler = HANDLERS[m.group(0)] if m else _handle_generic
+        return handler(result, jpg_file)
+    # each poller.result() is a network wait, so let N of them block in
+    # parallel; rows come back in input order via map
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = [row for row in executor.map(_process_file, jpg_files) if row is not None]
+    if results:
+        upsert_to_sqlite(results, "Generic_Forms", db_path)
+        export_to_excel(db_path, excel_path)
+
+async def default_model_result_async(directory_path, excel_path="test_docs_results_export.xlsx", *, db_path=DB_PATH, max_concurrency=16):
+    # Event-loop variant of default_model_result: one async client keeps
+    # hundreds of pollers in flight without a thread per request, with a
+    # semaphore as the RPS ceiling. Entry point: asyncio.run(...).
+    from azure.ai.formrecognizer.aio import DocumentAnalysisClient as AsyncDocumentAnalysisClient
+    jpg_files = [
+        entry.path for entry in os.scandir(directory_path)
+        if entry.is_file() and entry.name.lower().endswith(DOC_EXTS)
+    ]
+    semaphore = asyncio.Semaphore(max_concurrency)
+    async with AsyncDocumentAnalysisClient(
+        endpoint=endpoint, credential=AzureKeyCredential(key)
+    ) as client:
+        async def analyze(jpg_file):
+            async with semaphore:
+                with open(jpg_file, "rb") as f:
+                    poller = await client.begin_analyze_document(
+                        model_id="prebuilt-document", document=f
+                    )
+                    result = await poller.result()
+            print(f"Processed {jpg_file} with default model.")
+            m = _DOC_TYPE_RE.search(jpg_file)
+            handler = HANDLERS[m.group(0)] if m else _handle_generic
+            return handler(result, jpg_file)
+        rows = await asyncio.gather(*(analyze(p) for p in jpg_files), return_exceptions=True)
+    results = []
+    for jpg_file, row in zip(jpg_files, rows):
+        if isinstance(row, Exception):
+            print(f"Error analyzing {jpg_file}: {row}")
+        elif row is not None:
+            results.append(row)
     if results:
-        df = pd.DataFrame(results)
-        upsert_to_excel(df, "Generic_Forms", excel_path)
+        upsert_to_sqlite(results, "Generic_Forms", db_path)
+        export_to_excel(db_path, excel_path)
 
-def upsert_to_excel(df_new, sheet_name, excel_path):
+def upsert_to_sqlite(rows, table, db_path=DB_PATH, columns=RESULT_COLUMNS):
+    # SQLite is the primary store: INSERT OR REPLACE on file_name is O(rows
+    # added), not O(rows stored) like rewriting a sheet. export_to_excel
+    # materializes the xlsx once at the end of a run.
+    con = sqlite3.connect(db_path)
     try:
-        with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-            try:
-                df_existing = pd.read_excel(excel_path, sheet_name=sheet_name)
-            except Exception:
-                df_existing = pd.DataFrame(columns=df_new.columns)
-            df_combined = pd.concat([df_existing, df_new]).drop_duplicates(subset=["file_name"], keep='last')
-            df_combined.to_excel(writer, sheet_name=sheet_name, index=False)
-    except FileNotFoundError:
-        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
-            df_new.to_excel(writer, sheet_name=sheet_name, index=False)
+        cols = ", ".join(f'"{c}" TEXT' for c in columns)
+        con.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({cols})')
+        con.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_file_name" ON "{table}" (file_name)')
+        placeholders = ", ".join("?" for _ in columns)
+        con.executemany(
+            f'INSERT OR REPLACE INTO "{table}" VALUES ({placeholders})',
+            [[row.get(c, "") for c in columns] for row in rows],
+        )
+        con.commit()
+    finally:
+        con.close()
+
+def export_to_excel(db_path=DB_PATH, excel_path="test_docs_results_export.xlsx"):
+    con = sqlite3.connect(db_path)
+    try:
+        wb = openpyxl.Workbook(write_only=True)
+        tables = [r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        for table in tables:
+            cur = con.execute(f'SELECT * FROM "{table}"')
+            ws = wb.create_sheet(title=table)
+            ws.append([d[0] for d in cur.description])
+            for row in cur:
+                ws.append(list(row))
+        wb.save(excel_path)
+    finally:
+        con.close()
+
+def _page_label_matches(doc_path, page_index, model_id):
+    # Worker: pdfplumber Page objects don't pickle, so each worker opens the
+    # PDF itself and renders just its page.
+    with pdfplumber.open(doc_path) as pdf:
+        img_bytes = io.BytesIO()
+        # JPEG encodes several times faster than PNG at these sizes and
+        # uploads a fraction of the bytes; quality 85 is fine for OCR
+        pdf.pages[page_index].to_image(resolution=DPI).save(img_bytes, format="JPEG", quality=85)
+    result = _call_with_retry(model_call_bytes, img_bytes.getvalue(), model_id=model_id)
+    match_count, lines = 0, []
+    for kv_pair in result.key_value_pairs:
+        if kv_pair.confidence < KV_CONFIDENCE_MIN:
+            continue
+        key_content = kv_pair.key.content if kv_pair.key else ""
+        value_content = kv_pair.value.content if kv_pair.value else ""
+        stripped_val = value_content.strip().strip("{}").strip()
+        if stripped_val in _LABEL_SET:
+            match_count += 1
+        lines.append(f"Key: '{key_content}' -> Value: '{value_content}' Conf: {kv_pair.confidence:.2f}")
+    return match_count, lines
 
 def single_doc_testing(doc_path, model_id):
-    label_list_str = """<LABEL_LIST_PLACEHOLDER>"""
-    label_set = {lbl.strip() for lbl in label_list_str.split(",") if lbl.strip()}
-    match_count = 0
-    total_needed = len(label_set)
+    total_needed = len(_LABEL_SET)
     with pdfplumber.open(doc_path) as pdf:
-        for page in pdf.pages:
-            img_bytes = io.BytesIO()
-            page.to_image(resolution=300).save(img_bytes, format="PNG")
-            img_bytes.seek(0)
-            result = model_call_bytes(img_bytes.read(), model_id=model_id)
-            for kv_pair in result.key_value_pairs:
-                if kv_pair.confidence < KV_CONFIDENCE_MIN:
-                    continue
-                key_content = kv_pair.key.content if kv_pair.key else ""
-                value_content = kv_pair.value.content if kv_pair.value else ""
-                stripped_val = value_content.strip().strip("{}").strip()
-                if stripped_val in label_set:
-                    match_count += 1
-                print(f"Key: '{key_content}' -> Value: '{value_content}' Conf: {kv_pair.confidence:.2f}")
+        num_pages = len(pdf.pages)
+    match_count = 0
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 4)) as executor:
+        futures = [
+            executor.submit(_page_label_matches, doc_path, i, model_id)
+            for i in range(num_pages)
+        ]
+        for future in futures:
+            page_matches, lines = future.result()
+            match_count += page_matches
+            for line in lines:
+                print(line)
     print(f"\nMatched {match_count}/{total_needed} label placeholders")
 
 if __name__ == "__main__":